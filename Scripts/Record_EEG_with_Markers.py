@@ -8,17 +8,199 @@ import time
 import csv
 import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import threading
 import signal
 import sys
 import subprocess
+import shutil
 import os
+import gc
+import math
+from collections import deque
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
 from brainflow.data_filter import DataFilter
 
+# Numba is optional: without it CSV rows are formatted with Python string formatting
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _write_uint(out, pos, value):
+    """Write a non-negative integer as ASCII digits at out[pos:], return the new position"""
+    if value == 0:
+        out[pos] = 48  # '0'
+        return pos + 1
+    n_digits = 0
+    tmp = value
+    while tmp > 0:
+        tmp //= 10
+        n_digits += 1
+    for k in range(n_digits - 1, -1, -1):
+        out[pos + k] = 48 + value % 10
+        value //= 10
+    return pos + n_digits
+
+
+def _product_error(a, b):
+    """Rounding error of a * b (Dekker's two-product), so that a * b == fl(a * b) + error exactly"""
+    p = a * b
+    split = 134217729.0  # 2**27 + 1, Veltkamp splitting constant
+    t = split * a
+    a_hi = t - (t - a)
+    a_lo = a - a_hi
+    t = split * b
+    b_hi = t - (t - b)
+    b_lo = b - b_hi
+    return ((a_hi * b_hi - p) + a_hi * b_lo + a_lo * b_hi) + a_lo * b_lo
+
+
+def _write_fixed(out, pos, value, decimals):
+    """Write a float exactly as Python's '%.<decimals>f' would at out[pos:], return the new position
+
+    Returns -1 for finite values too large for int64 (|value| >= 2**63); the caller must
+    format those with Python instead.
+    """
+    if value != value:  # NaN ('%f' never prints a sign for it)
+        out[pos] = 110; out[pos + 1] = 97; out[pos + 2] = 110  # 'nan'
+        return pos + 3
+    if math.copysign(1.0, value) < 0:  # Includes -0.0 and values that round to zero
+        out[pos] = 45  # '-'
+        pos += 1
+    magnitude = abs(value)
+    if magnitude == np.inf:
+        out[pos] = 105; out[pos + 1] = 110; out[pos + 2] = 102  # 'inf'
+        return pos + 3
+    if magnitude >= 9.2e18:
+        return -1
+    
+    # Split before scaling so large values (e.g. epoch timestamps) keep their fractional precision;
+    # both the split and scaled - digits are exact in floating point
+    whole = np.floor(magnitude)
+    frac = magnitude - whole
+    scale = 10.0 ** decimals
+    scaled = frac * scale
+    digits = np.int64(scaled)
+    rest = scaled - digits
+    # rest and 0.5 are both multiples of ulp(scaled), which is larger than the product's
+    # rounding error, so only rest == 0.5 needs the exact error to round like '%f' does
+    if rest > 0.5:
+        digits += 1
+    elif rest == 0.5:
+        error = _product_error(frac, scale)
+        if error > 0 or (error == 0 and digits % 2 == 1):  # Exact ties round half to even
+            digits += 1
+    int_part = np.int64(whole)
+    if digits >= 10 ** decimals:
+        int_part += 1
+        digits -= 10 ** decimals
+    
+    pos = _write_uint(out, pos, int_part)
+    out[pos] = 46  # '.'
+    pos += 1
+    for k in range(decimals - 1, -1, -1):
+        out[pos + k] = 48 + digits % 10
+        digits //= 10
+    return pos + decimals
+
+
+def _format_block(samples, marker_ids, label_bytes, label_lengths, stamp_bytes, out):
+    """Write a batch of CSV rows (same layout as row_format) into out, return the byte count
+
+    Returns -1 if a value is out of the fixed-point formatter's range.
+    """
+    pos = 0
+    for i in range(samples.shape[0]):
+        pos = _write_uint(out, pos, np.int64(samples[i, 0]))  # Sample Index
+        out[pos] = 44  # ','
+        pos += 1
+        for j in range(1, 30):  # EXG, Accel and Other columns
+            pos = _write_fixed(out, pos, samples[i, j], 4)
+            if pos < 0:
+                return -1
+            out[pos] = 44
+            pos += 1
+        pos = _write_fixed(out, pos, samples[i, 30], 6)  # Timestamp
+        if pos < 0:
+            return -1
+        out[pos] = 44
+        pos += 1
+        label = marker_ids[i]
+        for k in range(label_lengths[label]):  # Marker Channel
+            out[pos] = label_bytes[label, k]
+            pos += 1
+        if stamp_bytes.shape[1] > 0:  # Timestamp (Formatted), only when enabled
+            out[pos] = 44
+            pos += 1
+            for k in range(stamp_bytes.shape[1]):
+                out[pos] = stamp_bytes[i, k]
+                pos += 1
+        out[pos] = 10  # '\n'
+        pos += 1
+    return pos
+
+
+def quote_csv_field(value):
+    """Quote a CSV field the way csv.writer does by default (only when it contains , " CR or LF)"""
+    if any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def format_timestamps(timestamps):
+    """Format a batch of epoch timestamps as local 'YYYY-mm-dd HH:MM:SS.mmm' strings
+
+    Same output as datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] for each timestamp.
+    """
+    # Round to whole microseconds first, as datetime.fromtimestamp does (fraction rounded half to even)
+    frac, whole = np.modf(np.asarray(timestamps, dtype=float))
+    micros = whole.astype(np.int64) * 1_000_000 + np.round(frac * 1e6).astype(np.int64)
+    
+    # Local UTC offset (DST-aware) looked up once per distinct second
+    seconds, inverse = np.unique(micros // 1_000_000, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(second, timezone.utc).astimezone().utcoffset() // timedelta(microseconds=1)
+                        for second in seconds.tolist()], dtype=np.int64)
+    formatted = pd.to_datetime(micros + offsets[inverse], unit='us')
+    return formatted.strftime('%Y-%m-%d %H:%M:%S.%f').str.slice(0, -3).to_numpy()
+
+
+def add_formatted_ts(csv_path):
+    """Append the 'Timestamp (Formatted)' column to a recording made without emit_formatted_ts
+
+    The result is the file a live emit_formatted_ts recording would have written: the %.6f
+    Timestamp column rounds to the same microsecond as the raw board timestamp.
+    """
+    with open(csv_path, newline='') as src:
+        reader = csv.reader(src)
+        header = next(reader)
+        if 'Timestamp (Formatted)' in header:
+            raise ValueError(f"{csv_path} already has a 'Timestamp (Formatted)' column")
+        ts_col = header.index('Timestamp')
+        timestamps = np.array([float(row[ts_col]) for row in reader])
+    formatted_times = format_timestamps(timestamps)
+    
+    # Records are re-split with the csv module, since quoted marker labels may contain newlines
+    tmp_path = csv_path + '.tmp'
+    with open(csv_path, newline='') as src, open(tmp_path, 'w', newline='') as dst:
+        reader = csv.reader(src)
+        dst.write(','.join(quote_csv_field(field) for field in next(reader)) + ',Timestamp (Formatted)\n')
+        for row, formatted_time in zip(reader, formatted_times):
+            dst.write(','.join(quote_csv_field(field) for field in row) + ',' + formatted_time + '\n')
+    os.replace(tmp_path, csv_path)
+
+
+if NUMBA_AVAILABLE:
+    _write_uint = njit(cache=True)(_write_uint)
+    _product_error = njit(cache=True)(_product_error)
+    _write_fixed = njit(cache=True)(_write_fixed)
+    _format_block = njit(cache=True)(_format_block)
+
 class EEGStreamerWithVideo:
-    def __init__(self, serial_port='/dev/ttyUSB0', csv_filename=None, video_path=None, marker_csv='marker.csv'):
+    def __init__(self, serial_port='/dev/ttyUSB0', csv_filename=None, video_path=None, marker_csv='marker.csv',
+                 emit_formatted_ts=False, cpu_affinity=None):
         self.serial_port = serial_port
         self.csv_filename = csv_filename or f"eeg_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         self.video_path = video_path
@@ -31,23 +213,49 @@ class EEGStreamerWithVideo:
         self.board = BoardShim(self.board_id, self.params)
         
         # Data tracking
-        self.is_streaming = False
+        self.is_streaming = False  # Acquisition loop keeps polling while set
+        self.board_streaming = False  # Board stream started and not yet stopped by stop_streaming
         self.sample_count = 0
-        self.start_time = None
-        self.recording_start_time = None
+        self.start_ns = None  # time.monotonic_ns() at stream start, for elapsed-time math
+        self.recording_start_ns = None
+        self.recording_start_time = None  # Wall clock, to align markers with BrainFlow's board timestamps
         self.csv_file = None
-        self.csv_writer = None
+        self.live_path = None  # File actually written during acquisition (may be in /dev/shm)
+        # Sample Index, 16 EXG + 3 Accel + 10 Other, Timestamp, Marker Channel[, Timestamp (Formatted)]
+        # The formatted column is derived data; add it afterwards with add_formatted_ts() if not emitted live
+        self.emit_formatted_ts = emit_formatted_ts
+        self.row_format = '%d,' + '%.4f,' * 29 + ('%.6f,%s,%s\n' if emit_formatted_ts else '%.6f,%s\n')
+        self.line_buffer = None  # Output scratch for the compiled formatter
+        self.batch_scratch = None  # Reused per-batch sample matrix, allocated by warm_up()
+        self.flushed_offsets = deque(maxlen=30)  # File offsets at the last 30 flushes (~kernel writeback delay)
+        self.advised_offset = 0  # CSV bytes already released from the page cache
+        self.poll_interval = 0.05  # Seconds between board reads
+        self.eeg_idx = None  # Board data rows, cached by cache_channel_indices()
+        self.accel_idx = None
+        self.ts_idx = None
+        self.realtime_priority = 20  # SCHED_FIFO priority for the acquisition thread
+        self.cpu_affinity = cpu_affinity  # CPUs for the acquisition thread, e.g. {3} (pair with isolcpus=3)
+        self.realtime_thread_id = None  # Native id of the thread moved to SCHED_FIFO, if any
+        self.pinned_thread_id = None  # Native id of the thread pinned to cpu_affinity, if any
+        self.original_affinity = None  # Its CPUs before pinning
+        
+        self.default_session_seconds = 900  # Session length estimate when no markers are loaded
         
         # Video and marker control
         self.video_process = None
-        self.markers_df = None
-        self.current_marker = ""
-        self.marker_thread = None
+        self.marker_times = None
+        self.marker_labels = None
+        self.marker_ends = None
+        self.marker_duration = 0.1  # Seconds each marker label stays on the Marker Channel
+        self.pyarrow_min_bytes = 1024 * 1024  # Marker files at least this large are parsed with PyArrow if installed
+        self.next_marker_index = 0  # First marker not yet reached by the board timestamps
+        self.announced_marker_index = 0  # First marker not yet printed by the monitor thread
         
         # Sampling rate monitoring
         self.last_sample_count = 0
-        self.last_time = None
-        self.sampling_rates = []
+        self.last_time_ns = None
+        self.sampling_rates = deque(maxlen=10)  # Last 10 readings for average calculation
+        self.monitor_thread = None
         
         # Load markers
         self.load_markers()
@@ -57,25 +265,60 @@ class EEGStreamerWithVideo:
         
     def signal_handler(self, sig, frame):
         """Handle Ctrl+C gracefully"""
-        print("\n\nStopping data stream...")
-        self.stop_streaming()
-        sys.exit(0)
+        if not self.is_streaming:
+            raise KeyboardInterrupt  # Not recording yet: main() cleans up
+        # Only end the acquisition loop: draining and cleanup must not run inside a batch it interrupted
+        self.is_streaming = False
+    
+    def read_marker_file(self):
+        """Read the time_seconds and label columns of the marker CSV as arrays (missing labels become '')"""
+        # PyArrow is optional and only worth importing for large marker files
+        if os.path.getsize(self.marker_csv) >= self.pyarrow_min_bytes:
+            try:
+                import pyarrow as pa
+                import pyarrow.csv as pa_csv
+            except ImportError:
+                pass
+            else:
+                options = pa_csv.ConvertOptions(column_types={'label': pa.string()}, strings_can_be_null=False)
+                table = pa_csv.read_csv(self.marker_csv, convert_options=options)
+                return (table['time_seconds'].to_numpy().astype(float),
+                        table['label'].to_numpy(zero_copy_only=False).astype(object))
+        markers_df = pd.read_csv(self.marker_csv, dtype={'label': str})
+        return (markers_df['time_seconds'].to_numpy(dtype=float),
+                markers_df['label'].fillna('').to_numpy(dtype=object))
     
     def load_markers(self):
         """Load marker data from CSV file"""
+        times, labels = np.empty(0), np.empty(0, dtype=object)
         try:
             if os.path.exists(self.marker_csv):
-                self.markers_df = pd.read_csv(self.marker_csv)
-                print(f"Loaded {len(self.markers_df)} markers from {self.marker_csv}")
+                times, labels = self.read_marker_file()
+                print(f"Loaded {len(times)} markers from {self.marker_csv}")
                 print("Marker preview:")
-                print(self.markers_df.head())
+                print(pd.DataFrame({'time_seconds': times[:5], 'label': labels[:5]}))
                 print()
             else:
                 print(f"Warning: Marker file {self.marker_csv} not found!")
-                self.markers_df = pd.DataFrame(columns=['time_seconds', 'label'])
         except Exception as e:
             print(f"Error loading markers: {e}")
-            self.markers_df = pd.DataFrame(columns=['time_seconds', 'label'])
+            times, labels = np.empty(0), np.empty(0, dtype=object)
+        
+        # Marker schedule as sorted arrays: each marker is active for [start, start + duration)
+        order = np.argsort(times, kind='stable')
+        self.marker_times = times[order]
+        self.marker_labels = labels[order]
+        self.marker_ends = self.marker_times + self.marker_duration
+        
+        # Marker Channel label table (id 0 is the empty label), CSV-quoted and also as padded bytes for the CSV formatter
+        unique_labels, codes = np.unique(self.marker_labels.astype(str), return_inverse=True)
+        self.marker_label_table = np.array([''] + [quote_csv_field(label) for label in unique_labels], dtype=object)
+        self.marker_codes = codes.astype(np.int64) + 1
+        encoded = [label.encode() for label in self.marker_label_table]
+        self.marker_label_lengths = np.array([len(label) for label in encoded], dtype=np.int64)
+        self.marker_label_bytes = np.zeros((len(encoded), max(1, self.marker_label_lengths.max())), dtype=np.uint8)
+        for i, label in enumerate(encoded):
+            self.marker_label_bytes[i, :len(label)] = np.frombuffer(label, dtype=np.uint8)
     
     def get_video_path(self):
         """Get video path from user if not provided"""
@@ -91,6 +334,25 @@ class EEGStreamerWithVideo:
             
         return video_path
         
+    def cache_channel_indices(self):
+        """Look up the board's channel rows once instead of on every batch"""
+        self.eeg_idx = np.asarray(BoardShim.get_eeg_channels(self.board_id)[:16])  # 16 channels for Cyton+Daisy
+        self.accel_idx = np.asarray(BoardShim.get_accel_channels(self.board_id))
+        self.ts_idx = BoardShim.get_timestamp_channel(self.board_id)
+        
+    def choose_live_path(self):
+        """Write to RAM-backed /dev/shm during acquisition when it has room for the whole session"""
+        shm_dir = '/dev/shm'
+        if not os.path.isdir(shm_dir) or os.path.abspath(self.csv_filename).startswith(shm_dir + os.sep):
+            return self.csv_filename
+        
+        # Generous estimate of the CSV size: ~400 bytes per row, doubled as safety margin
+        expected_bytes = self.expected_session_samples() * 400 * 2
+        if shutil.disk_usage(shm_dir).free < expected_bytes:
+            print(f"Not enough space in {shm_dir} for the session, writing directly to {self.csv_filename}")
+            return self.csv_filename
+        return os.path.join(shm_dir, os.path.basename(self.csv_filename))
+    
     def setup_csv(self):
         """Initialize CSV file with OpenBCI_GUI compatible headers"""
         headers = [
@@ -101,12 +363,16 @@ class EEGStreamerWithVideo:
             'EXG Channel 12', 'EXG Channel 13', 'EXG Channel 14', 'EXG Channel 15',
             'Accel Channel 0', 'Accel Channel 1', 'Accel Channel 2',
             'Other', 'Other', 'Other', 'Other', 'Other', 'Other', 'Other', 'Other',
-            'Other', 'Other', 'Timestamp', 'Marker Channel', 'Timestamp (Formatted)'
+            'Other', 'Other', 'Timestamp', 'Marker Channel'
         ]
+        if self.emit_formatted_ts:
+            headers.append('Timestamp (Formatted)')
         
-        self.csv_file = open(self.csv_filename, 'w', newline='', buffering=1)  # Line buffering for minimal latency
-        self.csv_writer = csv.writer(self.csv_file)
-        self.csv_writer.writerow(headers)
+        self.live_path = self.choose_live_path()
+        if self.live_path != self.csv_filename:
+            print(f"Staging live data in {self.live_path} (moved to {self.csv_filename} on stop)")
+        self.csv_file = open(self.live_path, 'wb', buffering=1024 * 1024)  # 1 MiB block buffer, flushed by the monitor thread
+        self.csv_file.write((','.join(headers) + '\n').encode())
     
     def start_video_player(self, video_path):
         """Start video player (MPV prioritized)"""
@@ -133,61 +399,115 @@ class EEGStreamerWithVideo:
             }
         ]
         
-        for player in players:
+        # Launch only the first installed player instead of trying each one
+        player = next((p for p in players if shutil.which(p['cmd'][0])), None)
+        if player is not None:
             try:
-                print(f"Trying to start {player['name']} with video: {video_path}")
                 self.video_process = subprocess.Popen(player['cmd'])
-                print(f"Successfully started {player['name']}")
+                print(f"Started {player['name']} with video: {video_path}")
                 return True
-            except FileNotFoundError:
-                print(f"{player['name']} not found, trying next player...")
-                continue
             except Exception as e:
                 print(f"Error starting {player['name']}: {e}")
-                continue
+                return False
         
         print("No video player found! Please install MPV:")
         print("- MPV: sudo apt install mpv")
         return False
     
-    def marker_control_thread(self):
-        """Thread to control markers based on timing"""
-        if self.markers_df.empty:
+    def advance_markers(self, last_timestamp):
+        """Count the markers whose start time has been reached by the latest sample"""
+        if self.recording_start_time is None:
             return
-            
-        print("Marker control thread started")
-        marker_index = 0
+        elapsed_time = last_timestamp - self.recording_start_time
+        n_due = np.searchsorted(self.marker_times, elapsed_time, side='right')
+        self.next_marker_index = max(self.next_marker_index, n_due)
+    
+    def announce_markers(self):
+        """Print the markers reached since the last call (monitor thread, keeps console I/O out of acquisition)"""
+        n_due = self.next_marker_index
+        lines = [f"\n[MARKER] Time: {self.marker_times[i]:.2f}s - {self.marker_labels[i]}\n"
+                 for i in range(self.announced_marker_index, n_due)]
+        self.announced_marker_index = n_due
+        if lines:
+            self.write_status(''.join(lines))
+    
+    def marker_ids_at(self, timestamps):
+        """Return the active marker id (index into marker_label_table, 0 = none) for each board timestamp"""
+        if not len(self.marker_times) or self.recording_start_time is None:
+            return np.zeros(len(timestamps), dtype=np.int64)
         
-        while self.is_streaming and marker_index < len(self.markers_df):
-            if self.recording_start_time is None:
-                time.sleep(0.01)
-                continue
-                
-            # Calculate elapsed time since recording started
-            elapsed_time = time.time() - self.recording_start_time
-            
-            # Check if it's time for the next marker
-            marker_time = self.markers_df.iloc[marker_index]['time_seconds']
-            
-            if elapsed_time >= marker_time:
-                marker_label = self.markers_df.iloc[marker_index]['label']
-                self.current_marker = marker_label
-                print(f"\n[MARKER] Time: {elapsed_time:.2f}s - {marker_label}")
-                
-                # Clear marker after a short duration (adjust as needed)
-                threading.Timer(0.1, self.clear_current_marker).start()
-                
-                marker_index += 1
-            
-            time.sleep(0.01)  # Check every 10ms for precise timing
+        elapsed = timestamps - self.recording_start_time
+        idx = np.searchsorted(self.marker_times, elapsed, side='right') - 1
+        safe_idx = np.maximum(idx, 0)
+        active = (idx >= 0) & (elapsed < self.marker_ends[safe_idx])
+        return np.where(active, self.marker_codes[safe_idx], 0)
+    
+    def markers_at(self, timestamps):
+        """Return the active marker label (or '') for each board timestamp"""
+        return self.marker_label_table[self.marker_ids_at(timestamps)]
+    
+    def set_realtime_priority(self, name):
+        """Move the calling thread to SCHED_FIFO (Linux, needs CAP_SYS_NICE or ulimit -r)"""
+        if not hasattr(os, 'sched_setscheduler'):
+            return False
+        try:
+            os.sched_setscheduler(threading.get_native_id(), os.SCHED_FIFO,
+                                  os.sched_param(self.realtime_priority))
+            self.realtime_thread_id = threading.get_native_id()
+            print(f"{name} thread running with SCHED_FIFO priority {self.realtime_priority}")
+            return True
+        except (PermissionError, OSError) as e:
+            print(f"Could not set real-time priority for {name} thread: {e}")
+            return False
+    
+    def pin_to_cpus(self, name):
+        """Restrict the calling thread to self.cpu_affinity (Linux)"""
+        if not self.cpu_affinity or not hasattr(os, 'sched_setaffinity'):
+            return False
+        try:
+            original_affinity = os.sched_getaffinity(threading.get_native_id())
+            os.sched_setaffinity(threading.get_native_id(), self.cpu_affinity)
+            self.pinned_thread_id = threading.get_native_id()
+            self.original_affinity = original_affinity
+            print(f"{name} thread pinned to CPU(s) {sorted(self.cpu_affinity)}")
+            return True
+        except OSError as e:
+            print(f"Could not pin {name} thread to CPU(s) {sorted(self.cpu_affinity)}: {e}")
+            return False
     
-    def clear_current_marker(self):
-        """Clear the current marker"""
-        self.current_marker = ""
+    def restore_scheduling(self):
+        """Return the acquisition thread to SCHED_OTHER and its original CPUs"""
+        if self.realtime_thread_id is not None:
+            try:
+                os.sched_setscheduler(self.realtime_thread_id, os.SCHED_OTHER, os.sched_param(0))
+            except OSError as e:
+                print(f"Could not restore normal scheduling: {e}")
+            self.realtime_thread_id = None
+        if self.pinned_thread_id is not None:
+            try:
+                os.sched_setaffinity(self.pinned_thread_id, self.original_affinity)
+            except OSError as e:
+                print(f"Could not restore CPU affinity: {e}")
+            self.pinned_thread_id = None
+    
+    def warm_up(self):
+        """Allocate and touch per-batch scratch memory and warm the formatters before streaming"""
+        sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        scratch_rows = int(sampling_rate * 0.2)  # Headroom for several 50 ms polls
+        self.batch_scratch = np.zeros((scratch_rows, 31))
+        self.batch_scratch.reshape(-1).view(np.uint8)[::4096] = 0  # Fault in the zero pages now
+        
+        format_timestamps(np.zeros(1))  # Loads pandas' datetime/strftime code paths
+        if NUMBA_AVAILABLE:
+            # Compiles the row formatter and sizes line_buffer for a full scratch batch
+            self.format_rows_compiled(self.batch_scratch, np.zeros(scratch_rows, dtype=np.int64),
+                                      format_timestamps(np.zeros(scratch_rows)) if self.emit_formatted_ts else None)
+            self.line_buffer[::4096] = 0
     
     def countdown(self, seconds=15):
         """Countdown before starting"""
         print(f"\nPreparing to start in {seconds} seconds...")
+        self.warm_up()
         for i in range(seconds, 0, -1):
             print(f"Starting in: {i} seconds", end='\r', flush=True)
             time.sleep(1)
@@ -203,6 +523,7 @@ class EEGStreamerWithVideo:
             
             print(f"Connecting to OpenBCI board on {self.serial_port}...")
             self.board.prepare_session()
+            self.cache_channel_indices()
             
             print("Setting up CSV file...")
             self.setup_csv()
@@ -210,40 +531,51 @@ class EEGStreamerWithVideo:
             # Countdown
             self.countdown(15) #### Time delay change garne yeha samaye
             
-            # Start video and EEG simultaneously
-            print("Starting video playback...")
-            if not self.start_video_player(video_path):
-                print("Failed to start video. Continuing with EEG only.")
+            # Collect once, then keep the cyclic GC from pausing the acquisition loop
+            gc.collect()
+            gc.disable()
             
+            # Start EEG first so launching the player doesn't delay the board's stream start,
+            # then the video; the recording clock starts once both are running
             print("Starting EEG data stream...")
             self.board.start_stream()
+            self.board_streaming = True
+            print("Starting video playback...")
+            if not self.start_video_player(video_path):
+                print("Failed to start video. Continuing with EEG only.")
             self.is_streaming = True
-            self.start_time = time.time()
-            self.recording_start_time = time.time()  # Record the exact start time
-            self.last_time = self.start_time
-            
-            # Start marker control thread
-            if not self.markers_df.empty:
-                self.marker_thread = threading.Thread(target=self.marker_control_thread, daemon=True)
-                self.marker_thread.start()
+            self.start_ns = time.monotonic_ns()
+            self.recording_start_ns = time.monotonic_ns()  # Record the exact start time
+            self.recording_start_time = time.time()  # Board timestamps are wall clock, so markers need it too
+            self.last_time_ns = self.start_ns
             
             # Start monitoring thread
-            monitor_thread = threading.Thread(target=self.monitor_sampling_rate, daemon=True)
-            monitor_thread.start()
+            self.monitor_thread = threading.Thread(target=self.monitor_sampling_rate, daemon=True)
+            self.monitor_thread.start()
+            
+            print(f"Recording EEG data to: {self.csv_filename}\n"
+                  "Video and EEG recording synchronized!\n"
+                  "Press Ctrl+C to stop recording\n", flush=True)
             
-            print(f"Recording EEG data to: {self.csv_filename}")
-            print("Video and EEG recording synchronized!")
-            print("Press Ctrl+C to stop recording\n")
+            # Elevate only after the helper threads and video player exist so they don't inherit it
+            self.set_realtime_priority("Acquisition")
+            self.pin_to_cpus("Acquisition")
             
             # Main data collection loop
+            next_poll = time.monotonic()
             while self.is_streaming:
-                # Get data from board
+                # Get data from board (BrainFlow buffers samples between polls)
                 data = self.board.get_board_data()
                 
                 if data.shape[1] > 0:  # If we have new data
                     self.process_data(data)
                 
-                time.sleep(0.001)  # Small sleep to prevent excessive CPU usage
+                # Poll on a fixed schedule (~6 samples per batch at 125 Hz)
+                next_poll += self.poll_interval
+                time.sleep(max(0.0, next_poll - time.monotonic()))
+            
+            print("\n\nStopping data stream...")
+            self.stop_streaming()
                 
         except Exception as e:
             print(f"Error during streaming: {e}")
@@ -251,84 +583,137 @@ class EEGStreamerWithVideo:
             
     def process_data(self, data):
         """Process and save the EEG data with markers"""
-        # Get channel information
-        eeg_channels = BoardShim.get_eeg_channels(self.board_id)
-        accel_channels = BoardShim.get_accel_channels(self.board_id)
-        timestamp_channel = BoardShim.get_timestamp_channel(self.board_id)
+        n_samples = data.shape[1]
+        n_eeg = len(self.eeg_idx)
+        timestamps = data[self.ts_idx]
         
-        # Process each sample
-        for i in range(data.shape[1]):
-            self.sample_count += 1
-            
-            # Prepare row data
-            row = [self.sample_count]  # Sample Index
-            
-            # EEG channels (16 channels for Cyton+Daisy)
-            for ch in range(16):
-                if ch < len(eeg_channels):
-                    row.append(data[eeg_channels[ch]][i])
-                else:
-                    row.append(0.0)  # Fill with zeros if channel doesn't exist
-            
-            # Accelerometer channels
-            for ch in accel_channels:
-                row.append(data[ch][i])
-            
-            # Fill remaining 'Other' columns with zeros
-            for _ in range(10):
-                row.append(0.0)
-            
-            # Timestamp (board timestamp)
-            board_timestamp = data[timestamp_channel][i]
-            row.append(board_timestamp)
-            
-            # Marker Channel - use current marker
-            row.append(self.current_marker)
-            
-            # Formatted timestamp
-            formatted_time = datetime.fromtimestamp(board_timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            row.append(formatted_time)
-            
-            # Write to CSV
-            self.csv_writer.writerow(row)
+        # Numeric columns (Sample Index .. Timestamp) in OpenBCI_GUI layout,
+        # in the preallocated scratch when it fits (columns not written below stay zero)
+        if self.batch_scratch is not None and n_samples <= len(self.batch_scratch):
+            samples = self.batch_scratch[:n_samples]
+        else:
+            samples = np.zeros((n_samples, 31))
+        samples[:, 0] = np.arange(self.sample_count + 1, self.sample_count + 1 + n_samples)  # Sample Index
+        samples[:, 1:1 + n_eeg] = data[self.eeg_idx].T  # EEG channels (missing ones stay zero)
+        samples[:, 17:20] = data[self.accel_idx].T  # Accelerometer channels ('Other' columns stay zero)
+        samples[:, 30] = timestamps  # Timestamp (board timestamp)
+        marker_ids = self.marker_ids_at(timestamps)
+        markers = self.marker_label_table[marker_ids]
+        self.advance_markers(timestamps[-1])
+        
+        formatted_times = format_timestamps(timestamps) if self.emit_formatted_ts else None
+        
+        self.sample_count += n_samples
+        
+        # Format the whole batch and write it to CSV in one call
+        rows = None
+        if NUMBA_AVAILABLE:
+            rows = self.format_rows_compiled(samples, marker_ids, formatted_times)
+        if rows is None:  # No numba, or values outside the compiled formatter's range
+            rows = self.format_rows_python(samples, markers, formatted_times)
+        self.csv_file.write(rows)
+    
+    def format_rows_python(self, samples, markers, formatted_times):
+        """Format a batch of CSV rows with row_format"""
+        if formatted_times is None:
+            lines = [self.row_format % (*row, marker) for row, marker in zip(samples.tolist(), markers)]
+        else:
+            lines = [self.row_format % (*row, marker, formatted_time)
+                     for row, marker, formatted_time in zip(samples.tolist(), markers, formatted_times)]
+        return ''.join(lines).encode()
+    
+    def format_rows_compiled(self, samples, marker_ids, formatted_times):
+        """Format a batch of CSV rows with the Numba-compiled formatter (None if it can't represent a value)"""
+        if formatted_times is None:
+            stamp_bytes = np.empty((len(samples), 0), dtype=np.uint8)
+        else:
+            stamp_bytes = np.asarray(formatted_times, dtype='S23').view(np.uint8).reshape(len(samples), 23)
+        # Worst case per row: 20-digit index, 30 numbers of up to 40 chars, label, stamp, separators
+        max_bytes = len(samples) * (20 + 30 * 40 + self.marker_label_bytes.shape[1] + 23 + 33)
+        if self.line_buffer is None or len(self.line_buffer) < max_bytes:
+            self.line_buffer = np.empty(max_bytes, dtype=np.uint8)
+        n_bytes = _format_block(samples, marker_ids, self.marker_label_bytes,
+                                self.marker_label_lengths, stamp_bytes, self.line_buffer)
+        if n_bytes < 0:
+            return None
+        return self.line_buffer[:n_bytes].tobytes()
             
+    def expected_session_seconds(self):
+        """Expected recording length, from the marker schedule when available"""
+        if len(self.marker_times):
+            return float(self.marker_times.max()) + 60  # Margin after the last marker
+        return self.default_session_seconds
+    
+    def expected_session_samples(self):
+        """Expected number of samples in the session, with 10% headroom"""
+        sampling_rate = BoardShim.get_sampling_rate(self.board_id)
+        return int(sampling_rate * self.expected_session_seconds() * 1.1)
+    
+    def release_written_pages(self):
+        """Tell the kernel it may drop already-written CSV pages from the page cache (Linux)"""
+        # Only applies when writing directly to csv_filename: when the live file is staged in
+        # /dev/shm (the usual case on Linux) its tmpfs pages are the file itself
+        if not hasattr(os, 'posix_fadvise') or self.live_path != self.csv_filename:
+            return
+        fd = self.csv_file.fileno()
+        self.flushed_offsets.append(os.lseek(fd, 0, os.SEEK_CUR))  # Bytes handed to the kernel so far
+        
+        # Dirty pages are ignored by DONTNEED, so only advise data flushed a full window ago
+        if len(self.flushed_offsets) == self.flushed_offsets.maxlen:
+            offset = self.flushed_offsets[0]
+            if offset > self.advised_offset:
+                os.posix_fadvise(fd, self.advised_offset, offset - self.advised_offset, os.POSIX_FADV_DONTNEED)
+                self.advised_offset = offset
+    
+    def write_status(self, line):
+        """Write the status line with a single write() call"""
+        sys.stdout.flush()  # Keep ordering with any pending print() output
+        os.write(sys.stdout.fileno(), line.encode())
+    
     def monitor_sampling_rate(self):
         """Monitor and display real-time sampling rate"""
         while self.is_streaming:
             time.sleep(1.0)  # Update every second
             
-            current_time = time.time()
+            # Push buffered CSV rows to the live file (on disk only when not staged in /dev/shm)
+            try:
+                self.csv_file.flush()
+                self.release_written_pages()
+            except (ValueError, AttributeError, OSError):
+                pass  # File already closed by stop_streaming
+            
+            self.announce_markers()
+            
+            current_ns = time.monotonic_ns()
             current_sample_count = self.sample_count
             
-            if self.last_time is not None:
+            if self.last_time_ns is not None:
                 samples_in_interval = current_sample_count - self.last_sample_count
-                time_interval = current_time - self.last_time
+                time_interval = (current_ns - self.last_time_ns) / 1e9
                 
                 if time_interval > 0:
                     current_rate = samples_in_interval / time_interval
                     self.sampling_rates.append(current_rate)
                     
-                    # Keep only last 10 readings for average calculation
-                    if len(self.sampling_rates) > 10:
-                        self.sampling_rates.pop(0)
-                    
                     avg_rate = np.mean(self.sampling_rates)
                     
                     # Display sampling rate info with recording time
-                    elapsed_time = current_time - self.start_time
-                    recording_time = current_time - self.recording_start_time if self.recording_start_time else 0
+                    recording_time = (current_ns - self.recording_start_ns) / 1e9 if self.recording_start_ns else 0
                     
-                    print(f"\rSamples: {current_sample_count:6d} | "
-                          f"Rate: {current_rate:6.1f} Hz | "
-                          f"Avg Rate: {avg_rate:6.1f} Hz | "
-                          f"Recording: {recording_time:6.1f}s", end='', flush=True)
+                    self.write_status(f"\rSamples: {current_sample_count:6d} | "
+                                      f"Rate: {current_rate:6.1f} Hz | "
+                                      f"Avg Rate: {avg_rate:6.1f} Hz | "
+                                      f"Recording: {recording_time:6.1f}s")
             
-            self.last_time = current_time
+            self.last_time_ns = current_ns
             self.last_sample_count = current_sample_count
             
     def stop_streaming(self):
         """Stop streaming and cleanup"""
-        if self.is_streaming:
+        self.restore_scheduling()  # Cleanup (e.g. moving the staged CSV) shouldn't run at real-time priority
+        gc.enable()  # Disabled for the duration of the recording
+        if self.board_streaming:
+            self.board_streaming = False
             self.is_streaming = False
             
             # Stop video player
@@ -342,15 +727,27 @@ class EEGStreamerWithVideo:
                     except:
                         pass
             
+            # Save the samples BrainFlow buffered since the last poll (up to 50 ms) before the session is released
+            try:
+                data = self.board.get_board_data()
+                if data.shape[1] > 0:
+                    self.process_data(data)
+            except Exception:
+                pass
+            
             # Stop board
             try:
                 self.board.stop_stream()
                 self.board.release_session()
             except:
                 pass
-                
-            if self.csv_file:
-                self.csv_file.close()
+            
+            # Let the monitor finish its current pass so it never touches the file (or a reused fd) after close
+            if self.monitor_thread and self.monitor_thread is not threading.current_thread():
+                self.monitor_thread.join(timeout=2)
+            self.announce_markers()  # Markers reached after the monitor's last pass
+            
+            self.close_csv()
                 
             print(f"\n\nStreaming stopped.")
             print(f"Total samples collected: {self.sample_count}")
@@ -359,6 +756,24 @@ class EEGStreamerWithVideo:
             if self.sampling_rates:
                 avg_rate = np.mean(self.sampling_rates)
                 print(f"Average sampling rate: {avg_rate:.1f} Hz")
+        else:
+            # Failed before streaming started (countdown, warm-up, start_stream): don't leave the
+            # staged file open in /dev/shm
+            self.close_csv()
+    
+    def close_csv(self):
+        """Close the CSV file and move a RAM-staged recording to its final location"""
+        if not self.csv_file:
+            return
+        self.csv_file.close()
+        self.csv_file = None
+        
+        if self.live_path != self.csv_filename:
+            try:
+                shutil.move(self.live_path, self.csv_filename)
+            except OSError as e:
+                print(f"\nCould not move {self.live_path} to {self.csv_filename}: {e}")
+                self.csv_filename = self.live_path
 
 def main():
     """Main function"""
@@ -370,13 +785,17 @@ def main():
     csv_filename = f"Subject_XX_eeg_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"  # Will auto-generate timestamp-based filename if None
     video_path = "Time_corrected_elbow_knee_mi_cue.mp4"  # VIDEO PATH in the same directory
     marker_csv = 'marker.csv'  # Marker file in same directory
+    emit_formatted_ts = '--verbose-ts' in sys.argv  # Also write 'Timestamp (Formatted)' while recording
+    cpu_affinity = None  # e.g. {3} to pin acquisition to an isolated core (boot with isolcpus=3)
     
     # Create and start streamer
     streamer = EEGStreamerWithVideo(
         serial_port=serial_port, 
         csv_filename=csv_filename,
         video_path=video_path,
-        marker_csv=marker_csv
+        marker_csv=marker_csv,
+        emit_formatted_ts=emit_formatted_ts,
+        cpu_affinity=cpu_affinity
     )
     
     try:
@@ -0,0 +1,27 @@
+"""Shared setup for the recorder tests"""
+
+import os
+import signal
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "Scripts"))
+
+
+@pytest.fixture
+def make_streamer():
+    """Factory for EEGStreamerWithVideo instances that never touch a board or the SIGINT handler"""
+    recorder = pytest.importorskip("Record_EEG_with_Markers")
+
+    def make(**kwargs):
+        kwargs.setdefault("csv_filename", os.devnull)
+        kwargs.setdefault("marker_csv", os.path.join(REPO_ROOT, "Data", "marker.csv"))
+        sigint_handler = signal.getsignal(signal.SIGINT)
+        streamer = recorder.EEGStreamerWithVideo(**kwargs)
+        signal.signal(signal.SIGINT, sigint_handler)
+        streamer.board = None  # Release the BoardShim now rather than at interpreter shutdown
+        return streamer
+
+    return make
@@ -0,0 +1,85 @@
+"""add_formatted_ts must reproduce the file a live emit_formatted_ts recording writes"""
+
+import csv
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("brainflow")
+
+import Record_EEG_with_Markers as recorder  # noqa: E402
+
+LABELS = ["Rest", "Left Hand MI", "Rest, eyes open", 'Say "go"', "Two\nlines"]
+
+
+def write_markers(tmp_path):
+    path = tmp_path / "marker.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time_seconds", "label"])
+        writer.writerows([0.5 * i, label] for i, label in enumerate(LABELS))
+    return str(path)
+
+
+def record(make_streamer, tmp_path, name, emit_formatted_ts, batches):
+    csv_path = str(tmp_path / name)
+    streamer = make_streamer(csv_filename=csv_path, marker_csv=write_markers(tmp_path),
+                             emit_formatted_ts=emit_formatted_ts)
+    streamer.choose_live_path = lambda: csv_path  # Write in place rather than staging in /dev/shm
+    streamer.cache_channel_indices()
+    streamer.recording_start_time = batches[0][streamer.ts_idx, 0]
+    streamer.setup_csv()
+    for data in batches:
+        streamer.process_data(data)
+    streamer.close_csv()
+    return csv_path
+
+
+def board_batches(n_rows):
+    """Fake Cyton+Daisy samples with 125 Hz wall-clock timestamps across the 2024 UK DST change"""
+    rng = np.random.default_rng(0)
+    n_samples = 125 * 4
+    timestamps = 1711846795.0 + np.arange(n_samples) / 125 + rng.random(n_samples) * 1e-6
+    timestamps[::7] = np.round(timestamps[::7], 3) + 0.0005  # Sub-millisecond ties
+    data = rng.normal(0, 50, (n_rows, n_samples))
+    return data, timestamps
+
+
+@pytest.fixture(params=["Europe/London", "America/New_York"])
+def local_tz(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_round_trip_matches_live_formatted_column(make_streamer, tmp_path, local_tz):
+    n_rows = recorder.BoardShim.get_num_rows(recorder.BoardIds.CYTON_DAISY_BOARD)
+    ts_idx = recorder.BoardShim.get_timestamp_channel(recorder.BoardIds.CYTON_DAISY_BOARD)
+    data, timestamps = board_batches(n_rows)
+    data[ts_idx] = timestamps
+    batches = [data[:, i:i + 6] for i in range(0, data.shape[1], 6)]
+
+    live = record(make_streamer, tmp_path, "live.csv", True, batches)
+    converted = record(make_streamer, tmp_path, "converted.csv", False, batches)
+    recorder.add_formatted_ts(converted)
+
+    with open(live, "rb") as a, open(converted, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_refuses_to_add_the_column_twice(make_streamer, tmp_path):
+    n_rows = recorder.BoardShim.get_num_rows(recorder.BoardIds.CYTON_DAISY_BOARD)
+    data = np.zeros((n_rows, 6))
+    data[recorder.BoardShim.get_timestamp_channel(recorder.BoardIds.CYTON_DAISY_BOARD)] = 1.7e9 + np.arange(6) / 125
+    path = record(make_streamer, tmp_path, "session.csv", False, [data])
+    recorder.add_formatted_ts(path)
+    with open(path, "rb") as f:
+        before = f.read()
+
+    with pytest.raises(ValueError):
+        recorder.add_formatted_ts(path)
+    with open(path, "rb") as f:
+        assert f.read() == before
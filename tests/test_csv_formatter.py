@@ -0,0 +1,93 @@
+"""Parity checks between the Numba-compiled CSV formatter and the row_format fallback"""
+
+import csv
+import io
+
+import numpy as np
+import pytest
+
+pytest.importorskip("brainflow")
+pytest.importorskip("numba")
+
+import Record_EEG_with_Markers as recorder  # noqa: E402
+
+
+def special_values():
+    """Signs, zeros, NaN/inf, large values and decimal ties / near-ties for 4 decimals"""
+    rng = np.random.default_rng(0)
+    ties = (rng.integers(-10**6, 10**6, 200) + 0.5) / 1e4
+    values = [0.0, -0.0, 0.00005, -0.00005, 0.00015, 0.00025, 1.00005, -2.99995, 0.125, 0.375,
+              1e-9, -1e-9, 5e-324, np.nan, -np.nan, np.inf, -np.inf, 1e15, -1e18, 9.1e18]
+    values += list(ties) + list(np.nextafter(ties, np.inf)) + list(np.nextafter(ties, -np.inf))
+    values += list(rng.normal(0, 1e4, 500) * rng.random(500) ** 4)
+    return np.array(values)
+
+
+def make_samples(values, rng):
+    """Spread values over the 29 fixed-point columns, with realistic index and timestamps"""
+    n_rows = -(-len(values) // 29)
+    samples = np.zeros((n_rows, 31))
+    samples[:, 0] = np.arange(1, n_rows + 1)
+    samples[:, 1:30].reshape(-1)[:len(values)] = values
+    # Epoch timestamps including ties and near-ties at 6 decimals
+    base = 1.7e9 + rng.integers(0, 10**6, n_rows) / 1e3
+    samples[:, 30] = base + (rng.integers(0, 10**6, n_rows) + 0.5) / 1e6
+    samples[::3, 30] = np.nextafter(samples[::3, 30], np.inf)
+    return samples
+
+
+@pytest.mark.parametrize("emit_formatted_ts", [False, True])
+def test_compiled_rows_match_row_format(make_streamer, emit_formatted_ts):
+    streamer = make_streamer(emit_formatted_ts=emit_formatted_ts)
+    rng = np.random.default_rng(1)
+    samples = make_samples(special_values(), rng)
+    marker_ids = rng.integers(0, len(streamer.marker_label_table), len(samples))
+    formatted_times = recorder.format_timestamps(samples[:, 30]) if emit_formatted_ts else None
+    compiled = streamer.format_rows_compiled(samples, marker_ids, formatted_times)
+    python = streamer.format_rows_python(samples, streamer.marker_label_table[marker_ids], formatted_times)
+
+    assert compiled is not None
+    for compiled_line, python_line in zip(compiled.decode().splitlines(), python.decode().splitlines()):
+        assert compiled_line == python_line
+    assert compiled == python
+
+
+def test_out_of_range_values_fall_back_to_python(make_streamer):
+    streamer = make_streamer()
+    samples = np.zeros((2, 31))
+    samples[:, 0] = [1, 2]
+    samples[1, 5] = 1e20
+    marker_ids = np.zeros(2, dtype=np.int64)
+
+    assert streamer.format_rows_compiled(samples, marker_ids, None) is None
+    assert b"100000000000000000000.0000" in streamer.format_rows_python(samples, ['', ''], None)
+
+
+@pytest.mark.parametrize("label", ["Rest, eyes open", 'Say "go"', "Two\nlines", "Carriage\rreturn", " plain "])
+def test_quote_csv_field_matches_csv_writer(label):
+    out = io.StringIO()
+    csv.writer(out).writerow([label, ""])
+    assert recorder.quote_csv_field(label) + ",\r\n" == out.getvalue()
+
+
+def test_marker_labels_are_csv_quoted(make_streamer, tmp_path):
+    labels = ["Rest, eyes open", 'Say "go"', "Two\nlines", "Left Hand MI"]
+    marker_csv = tmp_path / "marker.csv"
+    with open(marker_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time_seconds", "label"])
+        writer.writerows([i, label] for i, label in enumerate(labels))
+    streamer = make_streamer(marker_csv=str(marker_csv))
+    streamer.recording_start_time = 0.0
+
+    samples = np.zeros((len(labels), 31))
+    samples[:, 0] = np.arange(1, len(labels) + 1)
+    samples[:, 30] = np.arange(len(labels)) + 0.05
+    marker_ids = streamer.marker_ids_at(samples[:, 30])
+    compiled = streamer.format_rows_compiled(samples, marker_ids, None)
+    python = streamer.format_rows_python(samples, streamer.marker_label_table[marker_ids], None)
+
+    assert compiled == python
+    rows = list(csv.reader(io.StringIO(python.decode(), newline="")))
+    assert [len(row) for row in rows] == [32] * len(labels)
+    assert [row[31] for row in rows] == labels
@@ -0,0 +1,40 @@
+"""format_timestamps must match the per-row datetime.fromtimestamp strings it replaced"""
+
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+pytest.importorskip("brainflow")
+
+import Record_EEG_with_Markers as recorder  # noqa: E402
+
+
+@pytest.fixture(params=["America/New_York", "Europe/London", "Australia/Lord_Howe"])
+def local_tz(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def reference(timestamps):
+    return [datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] for ts in timestamps]
+
+
+def test_matches_fromtimestamp_across_dst_changes(local_tz):
+    rng = np.random.default_rng(0)
+    # A year of random timestamps, plus 125 Hz runs across every 2024 DST change in these zones
+    timestamps = [1.7e9 + rng.random(20000) * 3.2e7]
+    for change in [1710054000, 1730613600, 1711846800, 1729990800, 1712415600, 1727971200]:
+        timestamps.append(change - 2 + np.arange(500) / 125)
+    timestamps.append([1705922022.918, 1705922022.9995, 1705922022.0004999, 1705922022.0000005])
+    timestamps = np.concatenate(timestamps)
+
+    assert list(recorder.format_timestamps(timestamps)) == reference(timestamps)
+
+
+def test_single_timestamp(local_tz):
+    assert list(recorder.format_timestamps(np.array([1705922022.918]))) == reference([1705922022.918])
@@ -0,0 +1,92 @@
+"""Marker Channel labelling from the marker schedule and board timestamps"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("brainflow")
+
+
+def write_markers(tmp_path, rows):
+    path = tmp_path / "marker.csv"
+    path.write_text("time_seconds,label\n" + "".join(f"{t},{label}\n" for t, label in rows))
+    return str(path)
+
+
+def labelled_streamer(make_streamer, tmp_path, rows, recording_start_time=0.0):
+    streamer = make_streamer(marker_csv=write_markers(tmp_path, rows))
+    streamer.recording_start_time = recording_start_time
+    return streamer
+
+
+def test_marker_start_is_inclusive_and_end_exclusive(make_streamer, tmp_path):
+    streamer = labelled_streamer(make_streamer, tmp_path, [(1.0, "Left Hand MI")])
+    end = 1.0 + streamer.marker_duration
+    timestamps = np.array([np.nextafter(1.0, 0), 1.0, 1.05, np.nextafter(end, 0), end])
+
+    assert list(streamer.markers_at(timestamps)) == ["", "Left Hand MI", "Left Hand MI", "Left Hand MI", ""]
+
+
+def test_marker_times_are_relative_to_recording_start(make_streamer, tmp_path):
+    streamer = labelled_streamer(make_streamer, tmp_path, [(0.0, "Rest"), (2.0, "Knee MI")],
+                                 recording_start_time=1700000000.0)
+    timestamps = 1700000000.0 + np.array([-0.05, 0.0, 0.5, 2.0])
+
+    assert list(streamer.markers_at(timestamps)) == ["", "Rest", "", "Knee MI"]
+
+
+def test_samples_before_recording_start_are_unlabelled(make_streamer, tmp_path):
+    streamer = labelled_streamer(make_streamer, tmp_path, [(0.0, "Rest")], recording_start_time=100.0)
+
+    assert list(streamer.marker_ids_at(np.array([99.0, 99.99]))) == [0, 0]
+
+
+def test_overlapping_markers_take_the_later_start(make_streamer, tmp_path):
+    # Written out of order: the schedule is sorted by time when loaded
+    streamer = labelled_streamer(make_streamer, tmp_path, [(1.05, "B"), (1.0, "A")])
+    timestamps = np.array([1.02, 1.05, 1.08, 1.12, 1.16])
+
+    assert list(streamer.markers_at(timestamps)) == ["A", "B", "B", "B", ""]
+
+
+def test_empty_schedule_labels_nothing(make_streamer, tmp_path):
+    streamer = make_streamer(marker_csv=str(tmp_path / "missing.csv"))
+    streamer.recording_start_time = 0.0
+    marker_ids = streamer.marker_ids_at(np.linspace(0.0, 10.0, 50))
+
+    assert marker_ids.shape == (50,)
+    assert not marker_ids.any()
+
+
+def test_no_labels_before_the_recording_clock_starts(make_streamer):
+    streamer = make_streamer()
+
+    assert not streamer.marker_ids_at(np.array([0.0, 1e9])).any()
+
+
+def test_markers_are_announced_by_the_monitor_not_the_acquisition_loop(make_streamer, tmp_path, capfd):
+    streamer = labelled_streamer(make_streamer, tmp_path, [(0.0, "Rest"), (1.0, "Left Hand MI"), (5.0, "Knee MI")])
+    capfd.readouterr()
+
+    streamer.advance_markers(1.2)
+    assert streamer.next_marker_index == 2
+    assert capfd.readouterr().out == ""
+
+    streamer.announce_markers()
+    streamer.announce_markers()
+    assert capfd.readouterr().out == ("\n[MARKER] Time: 0.00s - Rest\n"
+                                      "\n[MARKER] Time: 1.00s - Left Hand MI\n")
+
+
+def test_pandas_and_pyarrow_marker_parsers_agree(make_streamer, tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "marker.csv"
+    path.write_text('time_seconds,label\n0.0,Rest\n1.5,\n2,1\n3.25,"Rest, eyes open"\n')
+    streamer = make_streamer(marker_csv=str(path))
+
+    streamer.pyarrow_min_bytes = float("inf")
+    pandas_times, pandas_labels = streamer.read_marker_file()
+    streamer.pyarrow_min_bytes = 0
+    arrow_times, arrow_labels = streamer.read_marker_file()
+
+    assert list(pandas_times) == list(arrow_times) == [0.0, 1.5, 2.0, 3.25]
+    assert list(pandas_labels) == list(arrow_labels) == ["Rest", "", "1", "Rest, eyes open"]